@@ -3,6 +3,8 @@ import shapely
 import shapely.ops
 import shapely.geometry
 import sys
+import json
+import struct
 from pprint import pprint
 import numpy
 from math import sqrt,cos,atan2,floor
@@ -29,7 +31,14 @@ def draw_line(p1, p2, color="black", alpha=1.0):
 # and maximum height of this airspace.
 #
 class Airspace:
-    def __init__(self, a):
+    def __init__(self, a = None):
+        self.index = None
+        self.indexer = None
+        
+        if a is None:
+            #filled by unpackAirspaces()
+            return
+        
         self.minFt = a.bottom.value
         self.minAGL = a.bottom.agl
         
@@ -41,11 +50,9 @@ class Airspace:
         self.setPolygon(shapely.geometry.Polygon(a.coordinates))
         self.class_name = a.category
         
-        self.index = None
-        self.indexer = None
-        
     def setIndexer(self, indexer):
         self.indexer = indexer
+        self.index = None
         
     def getIndex(self):
         if self.index == None:
@@ -63,9 +70,19 @@ class Airspace:
         self.polygon = polygon
         self.bb = self.polygon.bounds
         
+        # These are used for every raster point, so compute them only once
+        shapely.prepare(self.polygon)
+        self.boundary = self.polygon.boundary
+        
         ex = AIRSPACE_BORDER      
         self.near_box = shapely.geometry.box(self.bb[0] - ex, self.bb[1] - ex, self.bb[2] + ex, self.bb[3] + ex)
 
+    def __setstate__(self, state):
+        # A prepared polygon is not prepared anymore after pickling it
+        # to another process, so prepare it again
+        self.__dict__.update(state)
+        shapely.prepare(self.polygon)
+
     def getMin(self):
         return self.minFt, self.minAGL
     
@@ -98,9 +115,12 @@ class Airspace:
     # So this is used to compute the angle and distance of the
     # pilot to get into or out of the airspace.
     #
-    def getAirspaceVector(self, point):
+    # If the caller already knows, that the point is not inside,
+    # it can pass inside=False to skip the test.
+    #
+    def getAirspaceVector(self, point, inside = None):
     
-        nearest_points = shapely.ops.nearest_points(self.polygon.boundary, point)
+        nearest_points = shapely.ops.nearest_points(self.boundary, point)
         if len(nearest_points) != 2:
             print(len(nearest_points),"nearest points to",p)
             for np in nearest_points:
@@ -108,6 +128,41 @@ class Airspace:
             sys.exit(1)
         target = nearest_points[0]
             
-        av = AirspaceVector(self, point, target)
+        av = AirspaceVector(self, point, target, inside)
 
         return av
+
+
+# Serialize a list of airspaces, so another process can read them without
+# pickling every Airspace object. The data is the length of the JSON
+# metadata, the metadata and then the WKB of all polygons.
+def packAirspaces(airspaces):
+    wkbs = shapely.to_wkb([airspace.polygon for airspace in airspaces])
+    
+    meta = []
+    for airspace, wkb in zip(airspaces, wkbs):
+        meta.append([airspace.name, airspace.class_name, airspace.minFt, airspace.minAGL, airspace.maxFt, airspace.maxAGL, len(wkb)])
+    meta = json.dumps(meta).encode("utf-8")
+    
+    return struct.pack("<I", len(meta)) + meta + b"".join(wkbs)
+
+def unpackAirspaces(data):
+    size = struct.unpack_from("<I", data)[0]
+    meta = json.loads(data[4:4 + size].decode("utf-8"))
+    pos = 4 + size
+    
+    airspaces = []
+    for name, class_name, minFt, minAGL, maxFt, maxAGL, length in meta:
+        airspace = Airspace()
+        airspace.name = name
+        airspace.class_name = class_name
+        airspace.minFt = minFt
+        airspace.minAGL = minAGL
+        airspace.maxFt = maxFt
+        airspace.maxAGL = maxAGL
+        airspace.setPolygon(shapely.from_wkb(data[pos:pos + length]))
+        pos += length
+        
+        airspaces.append(airspace)
+        
+    return airspaces
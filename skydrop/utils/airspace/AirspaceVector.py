@@ -7,20 +7,36 @@ from gps_calc import *
 
 from math import sqrt
 
+# index, a, b as described in getRecord()
+RECORD = struct.Struct("BBB")
+
 
 class AirspaceVector:
 
-    def __init__(self, airspace = None, point = None, target = None):
+    def __init__(self, airspace = None, point = None, target = None, inside = None):
         self.airspace = airspace
         self.point = point
         self.target = target
         self.too_far = False
         
         if self.airspace:
-            self.inside = point.within(self.airspace.polygon)
-            self.distance_km = gps_distance_2d_shapely(self.point, self.target) / (100 * 1000)
+            if inside is None:
+                inside = self.airspace.polygon.contains(point)
+            self.inside = inside
+            
+            # read the coordinates only once, getRecord() just needs the offset
+            self.x, self.y = point.x, point.y
+            self.tx, self.ty = target.x, target.y
+            self.dx = self.tx - self.x
+            self.dy = self.ty - self.y
+            
+            # dumpPoint computes the distances of all airspaces at once,
+            # so this is only computed if asked for
+            self.distance_km = None
 
     def getDistance(self):
+        if self.distance_km is None:
+            self.distance_km = gps_distance_2d(self.x, self.y, self.tx, self.ty) / (100 * 1000)
         return self.distance_km
 
     def isInside(self):
@@ -31,10 +47,16 @@ class AirspaceVector:
         return pformat(vars(self))
     
     def getBytes(self):
+        return RECORD.pack(*self.getRecord())
+        
+    def packInto(self, buf, offset):
+        RECORD.pack_into(buf, offset, *self.getRecord())
+    
+    def getRecord(self):
         if self.airspace != None:
             index = self.airspace.getIndex()
         else:
-            return struct.pack("BBB", 0x7F, 0, 0)      
+            return 0x7F, 0, 0
             
         if self.inside:
             index |= 0x80
@@ -53,8 +75,8 @@ class AirspaceVector:
         # 1 1 mode3 offset with normalised vector
         mode = 0
             
-        offset_long = round((self.target.x - self.point.x) / OFFSET_MUL_0)
-        offset_lat = round((self.target.y - self.point.y) / OFFSET_MUL_0)
+        offset_long = round(self.dx / OFFSET_MUL_0)
+        offset_lat = round(self.dy / OFFSET_MUL_0)
         
         if abs(offset_long) > 63 or abs(offset_lat) > 63: 
             if abs(offset_long) > abs(offset_lat):
@@ -68,20 +90,20 @@ class AirspaceVector:
         if abs(offset_long) < MIN_RES and abs(offset_lat) < MIN_RES:
             mode = 1
         
-            offset_long = round((self.target.x - self.point.x) / OFFSET_MUL_1)
-            offset_lat = round((self.target.y - self.point.y) / OFFSET_MUL_1)
+            offset_long = round(self.dx / OFFSET_MUL_1)
+            offset_lat = round(self.dy / OFFSET_MUL_1)
 
             if abs(offset_long) < MIN_RES and abs(offset_lat) < MIN_RES:
                 mode = 2
                 
-                offset_long = round((self.target.x - self.point.x) / OFFSET_MUL_2)
-                offset_lat = round((self.target.y - self.point.y) / OFFSET_MUL_2)       
+                offset_long = round(self.dx / OFFSET_MUL_2)
+                offset_lat = round(self.dy / OFFSET_MUL_2)       
     
                 if abs(offset_long) < MIN_RES and abs(offset_lat) < MIN_RES:
                     mode = 3
                 
-                    off_x = self.target.x - self.point.x
-                    off_y = self.target.y - self.point.y
+                    off_x = self.dx
+                    off_y = self.dy
                     dist = sqrt(off_x ** 2 + off_y ** 2)
                     
                     if dist == 0:
@@ -102,7 +124,7 @@ class AirspaceVector:
                         new_point = shapely.geometry.Point(x, y)
 
                         new_av = self.airspace.getAirspaceVector(new_point) 
-                        return new_av.getBytes()         
+                        return new_av.getRecord()         
                     
                     mul = 60 / dist
                     
@@ -117,8 +139,8 @@ class AirspaceVector:
         if offset_long < 0:
             b |= 0x40
 
-        assert abs(offset_lat) <= 63, "offset_lat %d!!! mode %d dist %0.2fkm " % (offset_lat, mode, self.distance_km) + str(self.point)
-        assert abs(offset_long) <= 63, "offset_long %d!!! mode %d dist %0.2fkm " % (offset_long, mode, self.distance_km) + str(self.point)
+        assert abs(offset_lat) <= 63, "offset_lat %d!!! mode %d dist %0.2fkm " % (offset_lat, mode, self.getDistance()) + str(self.point)
+        assert abs(offset_long) <= 63, "offset_long %d!!! mode %d dist %0.2fkm " % (offset_long, mode, self.getDistance()) + str(self.point)
         assert not (a == 0 and b == 0), "A,B == 0" + str(self.target) + " " + str(self.point)
         
         #add sign
@@ -135,7 +157,5 @@ class AirspaceVector:
             a |= 0x80
             b |= 0x80
         
-        bytes = struct.pack("BBB", index, a, b)      
-            
-        return bytes
+        return index, a, b
 
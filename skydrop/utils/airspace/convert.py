@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- mode: python-mode; python-indent-offset: 4 -*-
 #*****************************************************************************
-# dnf install python3-shapely python3-gdal python3-matplotlib
+# dnf install python3-shapely python3-gdal python3-matplotlib python3-rtree python3-numba
 #
 # This program is used to read a "Open-Airspace-file" containing a number of
 # airspaces and then computing a raster of positions around these airspaces.
@@ -26,7 +26,7 @@ import sys
 import re
 import os
 
-from Airspace import Airspace
+from Airspace import Airspace, packAirspaces, unpackAirspaces
 from AirspaceVector import AirspaceVector
 from pprint import pprint
 import openaip
@@ -34,12 +34,19 @@ import openaip
 import shapely
 import shapely.ops
 import shapely.geometry
+import rtree
+from numba import njit
 import matplotlib.pyplot as plt
 import numpy
 import time
 import multiprocessing
+import concurrent.futures
+import traceback
+import tempfile
+import shutil
 import getopt
 import struct
+import pickle
 
 import cProfile
 
@@ -67,88 +74,304 @@ def getBoundingBox(airspaces):
         bb[3] = max(bb[3], bb2[3])
     return bb
 
-   
-def dumpPoint(output, offset, p, airspaces, check=False):
-
-    def av_score(av):
-        score = 0
-        
-        if av.isInside():
-            dist_score = 1
-        else:
-            dist_score = 1 - min(av.getDistance() / (33.0), 1)
-
-        score += dist_score * 10000   
-            
-        alt_score = 1 - min(av.airspace.getMin()[0] / 10000, 1)            
-        score += alt_score * 1000
+# Pages of a R-tree kept in memory. libspatialindex opens its disk files
+# for writing, even if the index is only read, and writes them again on
+# close. So a shared index is stored as a file of pages instead: every
+# process loads the pages and anything written goes to its own copy only.
+class PageStorage(rtree.index.CustomStorage):
+    def __init__(self, pages = None):
+        rtree.index.CustomStorage.__init__(self)
+        self.pages = dict(pages) if pages else {}
+        
+    def create(self, returnError):
+        pass
+        
+    def destroy(self, returnError):
+        pass
+        
+    def flush(self, returnError):
+        pass
+        
+    def clear(self):
+        self.pages.clear()
+        
+    def loadByteArray(self, page, returnError):
+        if page not in self.pages:
+            returnError.contents.value = self.InvalidPageError
+            return None
+        return self.pages[page]
+        
+    def storeByteArray(self, page, data, returnError):
+        if page == self.NewPage:
+            page = len(self.pages)
+            while page in self.pages:
+                page += 1
+        self.pages[page] = data
+        return page
+        
+    def deleteByteArray(self, page, returnError):
+        if page not in self.pages:
+            returnError.contents.value = self.InvalidPageError
+            return
+        del self.pages[page]
+        
+    @property
+    def hasData(self):
+        return len(self.pages) > 0
+
+# Build a R-tree holding the near box of every airspace, so dumpPoint only
+# has to look at the airspaces around a point instead of all of them.
+# The id of each entry is the position in the airspaces list.
+# If a filename is given, the index is also saved there, so other processes
+# can open it with openNearIndex() instead of building it again.
+def getNearIndex(airspaces, filename = None):
+    if filename is None:
+        idx = rtree.index.Index()
+    else:
+        storage = PageStorage()
+        idx = rtree.index.Index(storage)
         
-        class_score = CLASS_SCORE[av.airspace.getClass()]
-        score += class_score * 100
+    for i in range(len(airspaces)):
+        idx.insert(i, airspaces[i].near_box.bounds)
         
-        av.scores = {}
-        av.scores["D"] = dist_score
-        av.scores["A"] = alt_score
-        av.scores["C"] = class_score
-        av.scores["T"] = score
+    if filename is not None:
+        #close writes the header page, open again to keep using it
+        idx.close()
+        f = open(filename, "wb")
+        pickle.dump(storage.pages, f)
+        f.close()
+        idx = rtree.index.Index(PageStorage(storage.pages))
         
-        return score
+    return idx
 
-    global bVerbose
-    global mk_list
+# Open an index saved by getNearIndex(), the file is only read.
+# The header is the second page written to a new storage, which is the
+# index_id of 1 rtree uses by default.
+def openNearIndex(filename):
+    f = open(filename, "rb")
+    pages = pickle.load(f)
+    f.close()
+    return rtree.index.Index(PageStorage(pages))
 
-    avs = []
-    
-    #get all airspaces in proximity
-    for airspace in airspaces:
-        if airspace.isNear(p):
-            av = airspace.getAirspaceVector(p)
-            avs.append(av)
-            
-            if mk_list:
-                return True
+# Positions of the airspaces near the given point, in list order.
+# The R-tree also returns boxes with the point on their edge, these
+# are not near.
+def getNearAirspaces(idx, airspaces, p):
+    return [i for i in sorted(idx.intersection((p.x, p.y, p.x, p.y))) if airspaces[i].isNear(p)]
 
-    #sort by importance
-    avs.sort(key = av_score, reverse = True)
 
-    if check and bVerbose > 1:
-        print ("Airspaces here:")
-        i = 0
-        for av in avs:
-            air = av.airspace
-            if i == DATA_LEVELS:
-                print("-" * 120)
-            i += 1
-            
-            str_score = ""
-            for key in av.scores:
-                str_score += "%s %0.3f " % (key, av.scores[key])            
-            str_score = str_score[:-1]
-            
-            print("%50s %5u - %-5u %2s %5.2fkm %10s  %s" % 
-                (air.getName(), air.getMin()[0], air.getMax()[0], "IN" if av.isInside() else "", av.getDistance(), air.getClass(), str_score))
- 
-    #cut to max levels
-    avs = avs[:DATA_LEVELS]
+# Prepared union of all airspaces, None if it can not be built
+def getUnion(airspaces):
+    try:
+        union = shapely.ops.unary_union([airspace.polygon for airspace in airspaces])
+        shapely.prepare(union)
+        return union
+    except shapely.errors.GEOSException as e:
+        #invalid polygons, test every airspace on its own
+        print("Union of airspaces failed:", e)
+        return None
+
+# Buffers used by dumpPoint, allocated once for a list of airspaces.
+# The floor and class of every airspace are stored by its position in the
+# list, the other arrays are filled for the airspaces near a point.
+# The union of all airspaces (see getUnion) is used to skip the inside test
+# of every single airspace for points outside of all of them.
+class LevelBuffers(object):
+    def __init__(self, airspaces, union):
+        n = len(airspaces)
+        
+        self.union = union
+        
+        self.floor = numpy.array([airspace.getMin()[0] for airspace in airspaces], dtype=numpy.int64)
+        self.class_score = numpy.array([CLASS_SCORE[airspace.getClass()] for airspace in airspaces], dtype=numpy.float64)
+        
+        # Position of the floor of every airspace among all floors, sorted
+        # by height with AGL after MSL for the same height
+        floor_agl = numpy.array([airspace.getMin()[1] for airspace in airspaces], dtype=numpy.int64)
+        self.floor_rank = numpy.unique(self.floor * 2 + floor_agl, return_inverse=True)[1].astype(numpy.int64).reshape(-1)
+        
+        self.near = numpy.empty(n, dtype=numpy.int64)
+        self.inside = numpy.empty(n, dtype=numpy.bool_)
+        self.target_x = numpy.empty(n, dtype=numpy.float64)
+        self.target_y = numpy.empty(n, dtype=numpy.float64)
+        self.distance = numpy.empty(n, dtype=numpy.float64)
+        self.dist_score = numpy.empty(n, dtype=numpy.float64)
+        self.alt_score = numpy.empty(n, dtype=numpy.float64)
+        self.score = numpy.empty(n, dtype=numpy.float64)
+        
+        self.empty = AirspaceVector().getBytes()
+
+# Score the first n airspaces in near by importance. The distance from the
+# point (x, y) to the nearest point of every airspace is written to distance,
+# the distance, altitude and total score to dist_score, alt_score and score.
+@njit(cache=True)
+def scoreAirspaces(n, x, y, near, inside, target_x, target_y, floor, class_score, distance, dist_score, alt_score, score):
+    for i in range(n):
+        distance[i] = gps_distance_2d(x, y, target_x[i], target_y[i]) / (100 * 1000)
+        
+        if inside[i]:
+            dist_score[i] = 1.0
+        else:
+            dist_score[i] = 1.0 - min(distance[i] / 33.0, 1.0)
+        alt_score[i] = 1.0 - min(floor[near[i]] / 10000, 1.0)
+        score[i] = dist_score[i] * 10000 + alt_score[i] * 1000 + class_score[near[i]] * 100
+
+# Select the levels stored for a point: the most important airspaces
+# ordered by their floor, using the precomputed floor_rank.
+@njit(cache=True)
+def selectLevels(n, near, score, floor_rank, levels):
+    order = numpy.argsort(-score[:n], kind="mergesort")[:levels]
+    key = numpy.empty(len(order), dtype=numpy.int64)
+    for i in range(len(order)):
+        key[i] = floor_rank[near[order[i]]]
+    return order[numpy.argsort(key, kind="mergesort")]
 
-    #sort by min alt
-    avs.sort(key = lambda av: av.airspace.getMin())
+   
+# Print the scores of the airspaces around a point for --check
+def printAirspaces(avs, buffers):
+    print ("Airspaces here:")
+    i = 0
+    for j in numpy.argsort(-buffers.score[:len(avs)], kind="stable"):
+        av = avs[j]
+        air = av.airspace
+        if i == DATA_LEVELS:
+            print("-" * 120)
+        i += 1
+        
+        str_score = "D %0.3f A %0.3f C %0.3f T %0.3f" % (buffers.dist_score[j], buffers.alt_score[j], buffers.class_score[buffers.near[j]], buffers.score[j])
+        
+        print("%50s %5u - %-5u %2s %5.2fkm %10s  %s" % 
+            (air.getName(), air.getMin()[0], air.getMax()[0], "IN" if av.isInside() else "", av.getDistance(), air.getClass(), str_score))
+
+# Vectors from the point p to the airspaces in near, computed one by one.
+# dumpRow() computes them for a whole row at once.
+def getAirspaceVectors(p, airspaces, near, buffers):
+    inside = None
+    if buffers.union is not None and len(near) > 0 and not buffers.union.contains(p):
+        inside = False
+    
+    return [airspaces[i].getAirspaceVector(p, inside) for i in near]
+
+# Store the levels of the point p. avs are the vectors to the airspaces
+# in near (the positions in the airspaces list).
+def dumpPoint(output, offset, p, near, avs, buffers, check=False):
+
+    near_buf = buffers.near
+    inside_buf = buffers.inside
+    target_x = buffers.target_x
+    target_y = buffers.target_y
+    n = len(avs)
+    for j in range(n):
+        av = avs[j]
+        near_buf[j] = near[j]
+        inside_buf[j] = av.inside
+        target_x[j] = av.tx
+        target_y[j] = av.ty
+
+    if n > 0:
+        scoreAirspaces(n, p.x, p.y, near_buf, inside_buf, target_x, target_y, buffers.floor, buffers.class_score,
+                       buffers.distance, buffers.dist_score, buffers.alt_score, buffers.score)
+        
+        if check and bVerbose > 1:
+            printAirspaces(avs, buffers)
+        
+        #most important airspaces, sorted by min alt
+        avs = [avs[j] for j in selectLevels(n, buffers.near, buffers.score, buffers.floor_rank, DATA_LEVELS)]
 
     if output is not None:
         #store to data file
         for av in avs:
-            for byte in av.getBytes():
-                output[offset] = byte
-                offset += 1
-                    
+            av.packInto(output, offset)
+            offset += DATA_LEVEL_SIZE
+            
         # Fill up with empty Airspaces
-        av = AirspaceVector()
-        for i in range(DATA_LEVELS - len(avs)):
-            for byte in av.getBytes():
-                output[offset] = byte
-                offset += 1
+        empty = DATA_LEVELS - len(avs)
+        output[offset:offset + empty * DATA_LEVEL_SIZE] = buffers.empty * empty
                 
     return len(avs)
+
+# State of the processes computing the rows of a tile, see initRowWorker()
+rowAirspaces = None
+rowPositions = None
+rowIdx = None
+rowNearBounds = None
+rowBuffers = None
+rowPoints = None
+
+def initRowWorker(airspaces, points, idx, buffers):
+    global rowAirspaces, rowPositions, rowIdx, rowNearBounds, rowBuffers, rowPoints
+
+    rowAirspaces = airspaces
+    rowPositions = {}
+    for i in range(len(airspaces)):
+        rowPositions[id(airspaces[i])] = i
+    rowIdx = idx
+    rowNearBounds = numpy.array([airspace.near_box.bounds for airspace in airspaces]).reshape(-1, 4)
+    rowBuffers = buffers
+    rowPoints = points
+
+# Compute a single row of a tile. As the index of an airspace is given
+# by the order in which the airspaces are used, every row is indexed on its
+# own. Beside the data of the row, the position of the airspace in the
+# airspaces list is returned for each local index, so the caller can
+# translate the row to the index of the tile.
+def dumpRow(row):
+    points = rowPoints[row]
+    
+    indexer = Indexer()
+    for airspace in rowAirspaces:
+        airspace.setIndexer(indexer)
+    
+    # The R-tree gives the airspaces near the row, test the near boxes of
+    # these against all points of the row at once. A point on the edge of
+    # a near box is not near, as in Airspace.isNear.
+    xs = shapely.get_x(points)
+    ys = shapely.get_y(points)
+    candidates = numpy.array(sorted(rowIdx.intersection((xs.min(), ys.min(), xs.max(), ys.max()))), dtype=int)
+    bounds = rowNearBounds[candidates]
+    near = ((bounds[None, :, 0] < xs[:, None]) & (xs[:, None] < bounds[None, :, 2]) &
+            (bounds[None, :, 1] < ys[:, None]) & (ys[:, None] < bounds[None, :, 3]))
+    
+    union = rowBuffers.union
+    if union is not None:
+        in_union = shapely.contains(union, points)
+    
+    # Compute the vectors of every near airspace for all points of the row
+    # at once. The candidates are sorted, so the vectors of every point
+    # are in the order of the airspaces list.
+    point_near = [[] for col in range(len(points))]
+    point_avs = [[] for col in range(len(points))]
+    for k in range(len(candidates)):
+        cols = numpy.nonzero(near[:, k])[0]
+        if len(cols) == 0:
+            continue
+        
+        airspace = rowAirspaces[candidates[k]]
+        pts = points[cols]
+        targets = shapely.get_point(shapely.shortest_line(airspace.boundary, pts), 0)
+        
+        if union is None:
+            inside = shapely.contains(airspace.polygon, pts)
+        else:
+            #points outside of the union are not inside of any airspace
+            inside = numpy.zeros(len(cols), dtype=bool)
+            mask = in_union[cols]
+            inside[mask] = shapely.contains(airspace.polygon, pts[mask])
+        
+        for j in range(len(cols)):
+            col = cols[j]
+            point_near[col].append(candidates[k])
+            point_avs[col].append(AirspaceVector(airspace, pts[j], targets[j], bool(inside[j])))
+    
+    output = bytearray(len(points) * DATA_LEVELS * DATA_LEVEL_SIZE)
+    for col in range(len(points)):
+        dumpPoint(output, col * DATA_LEVELS * DATA_LEVEL_SIZE, points[col], point_near[col], point_avs[col], rowBuffers)
+        
+    used = []
+    for i in range(indexer.num):
+        used.append(rowPositions[id(indexer.list[i])])
+        
+    return row, output, used
       
 class Indexer(object):
     def __init__(self):
@@ -208,7 +431,7 @@ class Indexer(object):
         return buff
     
         
-def dump(lon, lat, airspaces):
+def dump(lon, lat, airspaces, parallelism = 1, idx = None, buffers = None):
 
     #print("lon, lat", lon, lat)
 
@@ -263,10 +486,14 @@ def dump(lon, lat, airspaces):
             print("%s Not needed for this airspace, skipping..." % filename)
             return
             
+        #the index and buffers of the given airspaces do not fit anymore
+        idx = None
+        buffers = None
+        airspaces = list(airspaces)
         for a in needed_as:
             if a == DataSource:
                 continue
-            load_airspace(a)
+            airspaces += load_airspace(a)
    
     #is this airspace over water?
     if os.path.exists("agl_tiles.list"):
@@ -288,6 +515,17 @@ def dump(lon, lat, airspaces):
             return
             
     
+    if idx is None:
+        idx = getNearIndex(airspaces)
+    
+    #no airspace is near this tile at all
+    if idx.count((lon, lat, lon + 1, lat + 1)) == 0:
+        print (filename, "is empty")
+        return
+    
+    if buffers is None:
+        buffers = LevelBuffers(airspaces, getUnion(airspaces))
+    
     numPoints = wantedResolution
     filesize = numPoints * numPoints * DATA_LEVELS * DATA_LEVEL_SIZE
 
@@ -297,19 +535,15 @@ def dump(lon, lat, airspaces):
     
     indexer = Indexer()
     
-    for airspace in airspaces:
-        airspace.setIndexer(indexer)
-    
     try:
-        # Quickcheck for emptyness
+        # Quickcheck for emptyness, a point has data if any airspace is near
         isEmpty = True
         delta = AIRSPACE_BORDER / 2
         
         print (filename, "Checking...")
         for lat_i in numpy.arange(lat + delta / 2, lat + 1, delta):
             for lon_i in numpy.arange(lon + delta / 2, lon + 1, delta):
-                p = shapely.geometry.Point(lon_i, lat_i)
-                if dumpPoint(None, 0, p, airspaces) > 0:
+                if len(getNearAirspaces(idx, airspaces, shapely.geometry.Point(lon_i, lat_i))) > 0:
                     isEmpty = False
                 if not isEmpty:
                     break
@@ -334,23 +568,56 @@ def dump(lon, lat, airspaces):
             f = open("data/" + filename, 'wb')
             last_per = 999
             
-            for lat_i in numpy.arange(lat, lat + 1, 1 / numPoints):
-                pos += 1
-                per = int((pos * 100) / numPoints)
-                if per != last_per:
-                    print ("%s: %u %%" % (filename, per))
-                    last_per = per
-                    
-                for lon_i in numpy.arange(lon, lon + 1, 1 / numPoints):
-                    off = (1 / numPoints) * 0.5
-                    p = shapely.geometry.Point(lon_i + off, lat_i + off)
+            lats = numpy.arange(lat, lat + 1, 1 / numPoints)
+            lons = numpy.arange(lon, lon + 1, 1 / numPoints)
+            
+            # Create all points of the raster in one go, every point is
+            # in the center of its raster cell
+            off = (1 / numPoints) * 0.5
+            lon_grid, lat_grid = numpy.meshgrid(lons + off, lats + off)
+            points = shapely.points(lon_grid, lat_grid)
+            
+            mul = HGT_COORD_MUL
+            xs = numpy.round(((lons * mul) % mul) * numPoints / mul).astype(int)
+            ys = numpy.round(((lats * mul) % mul) * numPoints / mul).astype(int)
+            offsets = (xs[None, :] * numPoints + ys[:, None]) * DATA_LEVELS * DATA_LEVEL_SIZE
+            
+            pool = None
+            if parallelism > 1:
+                #the workers must inherit the in-memory R-tree, it loses its
+                #entries when pickled, so fork them whatever the default is
+                pool = multiprocessing.get_context("fork").Pool(parallelism, initializer=initRowWorker, initargs=(airspaces, points, idx, buffers))
+                rows = pool.imap(dumpRow, range(len(lats)))
+            else:
+                initRowWorker(airspaces, points, idx, buffers)
+                rows = map(dumpRow, range(len(lats)))
+            
+            # rows are returned in order, so the index of the airspaces
+            # is the same as if the tile was computed point by point
+            tileIndex = {}
+            size = DATA_LEVELS * DATA_LEVEL_SIZE
+            try:
+                for row, row_output, used in rows:
+                    pos += 1
+                    per = int((pos * 100) / numPoints)
+                    if per != last_per:
+                        print ("%s: %u %%" % (filename, per))
+                        last_per = per
                     
-                    mul = HGT_COORD_MUL
-                    x = int(round(((lon_i) * mul % mul) * numPoints / mul))
-                    y = int(round(((lat_i) * mul % mul) * numPoints / mul))
+                    table = bytearray(range(256))
+                    for i in range(len(used)):
+                        if used[i] not in tileIndex:
+                            tileIndex[used[i]] = indexer.getNext(airspaces[used[i]])
+                        table[i] = tileIndex[used[i]]
+                        table[i | 0x80] = tileIndex[used[i]] | 0x80
+                    row_output[0::DATA_LEVEL_SIZE] = row_output[0::DATA_LEVEL_SIZE].translate(table)
                     
-                    offset = int((x * numPoints + y) * DATA_LEVELS * DATA_LEVEL_SIZE)
-                    dumpPoint(output, offset, p, airspaces)
+                    for col in range(len(lons)):
+                        offset = int(offsets[row, col])
+                        output[offset:offset + size] = row_output[col * size:(col + 1) * size]
+            finally:
+                if pool:
+                    pool.terminate()
                     
     except (KeyboardInterrupt, SystemExit):
         print("Exiting...")
@@ -358,12 +625,7 @@ def dump(lon, lat, airspaces):
             f.close()
             os.system("rm data/" + filename)
 
-    isEmpty = True
-    for byte in output:
-        if byte != 0:
-            isEmpty = False
-            break   
-    if isEmpty:
+    if output.count(0) == len(output):
         print (filename, "is empty")
     else:
         f.write(bytes(output))
@@ -376,6 +638,33 @@ def dump(lon, lat, airspaces):
         pr.disable()
         pr.print_stats(sort = "cumtime")
 
+# State of the processes computing whole tiles, see initTileWorker()
+tileAirspaces = None
+tileIdx = None
+tileBuffers = None
+
+def initTileWorker(directory):
+    global tileAirspaces, tileIdx, tileBuffers
+    
+    f = open(os.path.join(directory, "airspaces.bin"), "rb")
+    tileAirspaces = unpackAirspaces(f.read())
+    f.close()
+    
+    tileIdx = openNearIndex(os.path.join(directory, "near.pages"))
+    
+    #the union is missing if it could not be built
+    union = None
+    filename = os.path.join(directory, "union.wkb")
+    if os.path.exists(filename):
+        f = open(filename, "rb")
+        union = shapely.from_wkb(f.read())
+        f.close()
+        shapely.prepare(union)
+    tileBuffers = LevelBuffers(tileAirspaces, union)
+
+def dumpTile(lon, lat):
+    dump(lon, lat, tileAirspaces, 1, tileIdx, tileBuffers)
+
 def load_airspace(filename):
     filename = "source/" + filename
     print("Loading %s" % filename)
@@ -386,9 +675,9 @@ def load_airspace(filename):
     invalid = []
     
     global bVerbose    
-    global airspaces
     global inspect
 
+    airspaces = []
 
     for oas in openaip.load_file(filename):
     
@@ -437,7 +726,7 @@ def load_airspace(filename):
             print(" ", s)
         print()
         
-        return
+    return airspaces
 
 #**********************************************************************
 #                                main()
@@ -514,7 +803,7 @@ def main(argv = None):
         
         
     DataSource = os.path.basename(DataSource)
-    load_airspace(DataSource)
+    airspaces.extend(load_airspace(DataSource))
 
     boundingBox = getBoundingBox(airspaces)
     print("BoundingBox:", boundingBox)
@@ -527,7 +816,10 @@ def main(argv = None):
             airspace.setIndexer(indexer)    
     
         output = bytearray(DATA_LEVELS * DATA_LEVEL_SIZE)
-        dumpPoint(output, 0, checkPoint, airspaces, True)
+        buffers = LevelBuffers(airspaces, getUnion(airspaces))
+        near = getNearAirspaces(getNearIndex(airspaces), airspaces, checkPoint)
+        avs = getAirspaceVectors(checkPoint, airspaces, near, buffers)
+        dumpPoint(output, 0, checkPoint, near, avs, buffers, True)
         
         print()
         for level in range(DATA_LEVELS):
@@ -561,36 +853,46 @@ def main(argv = None):
 
     if checkPoint == None:   
         try:
-            procs = []
-            if latOnly != None and lonOnly != 0:
-                p = multiprocessing.Process(target=dump, args=(lonOnly,latOnly,airspaces))
-                procs.append(p)
-            else:
-                for lat in range(int(boundingBox[1])-1,int(boundingBox[3])+2):
-                    for lon in range(int(boundingBox[0])-1,int(boundingBox[2])+2):
-                        p = multiprocessing.Process(target=dump, args=(lon,lat,airspaces))
-                        procs.append(p)
-
-            running = []
             parallelism = multiprocessing.cpu_count()    # set to "1" for sequential
             if mk_list:
                 #if we are making list use only one, since we are writing the result to single file
                 parallelism = 1 
                 os.system("rm lists/%s.list" % os.path.basename(DataSource))
 
-            while len(procs) > 0 or len(running) > 0:
-                # Start as much processes as we have CPUs
-                while len(running) < parallelism and len(procs) > 0:
-                    p = procs.pop(0)
-                    p.start()
-                    running.append(p)
-                for i in range(len(running)):
-                    if not running[i].is_alive():
-                        running[i].join()
-                        del running[i]
-                        # "i" is now wrong, break out and restart
-                        break      
-                #time.sleep(0.1)
+            if latOnly != None and lonOnly != 0:
+                #single tile, compute its rows in parallel
+                dump(lonOnly, latOnly, airspaces, parallelism)
+            else:
+                #the workers read the airspaces and their index only once, when they are started
+                directory = tempfile.mkdtemp(prefix="airspaces_")
+                f = open(os.path.join(directory, "airspaces.bin"), "wb")
+                f.write(packAirspaces(airspaces))
+                f.close()
+                getNearIndex(airspaces, os.path.join(directory, "near.pages")).close()
+                union = getUnion(airspaces)
+                if union is not None:
+                    f = open(os.path.join(directory, "union.wkb"), "wb")
+                    f.write(shapely.to_wkb(union))
+                    f.close()
+                
+                executor = concurrent.futures.ProcessPoolExecutor(parallelism, initializer=initTileWorker, initargs=(directory,))
+                try:
+                    futures = {}
+                    for lat in range(int(boundingBox[1])-1,int(boundingBox[3])+2):
+                        for lon in range(int(boundingBox[0])-1,int(boundingBox[2])+2):
+                            futures[executor.submit(dumpTile, lon, lat)] = (lon, lat)
+                    
+                    #a failing tile must not stop the others
+                    for future in concurrent.futures.as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception:
+                            lon, lat = futures[future]
+                            print("Tile lat %d lon %d failed:" % (lat, lon))
+                            traceback.print_exc()
+                finally:
+                    executor.shutdown(cancel_futures = True)
+                    shutil.rmtree(directory)
 
         except (KeyboardInterrupt, SystemExit):
             print("Exiting (main)...")
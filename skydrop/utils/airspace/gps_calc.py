@@ -1,5 +1,6 @@
 import numpy
 from math import cos, sqrt, atan2
+from numba import njit
 
 def gps_bearing_shapely(P1, P2):
     p1 = numpy.array([P1.x,P1.y])
@@ -9,11 +10,16 @@ def gps_bearing_shapely(P1, P2):
     return (numpy.degrees(atan2(d[0],d[1])) + 360) % 360
 
 def gps_distance_2d_shapely(P1, P2):
-    lat = (P1.y + P2.y) / 2 * (numpy.pi / 180.0)
+    return gps_distance_2d(P1.x, P1.y, P2.x, P2.y)
+
+# compiled, so it can also be used inside of numba kernels
+@njit(cache=True)
+def gps_distance_2d(lon1, lat1, lon2, lat2):
+    lat = (lat1 + lat2) / 2 * (numpy.pi / 180.0)
 
     # 111.3 km (in cm) is the width of 1 degree
-    dx = cos(lat) * 11130000 * abs(P1.x - P2.x)
-    dy = 1.0      * 11130000 * abs(P1.y - P2.y)
+    dx = cos(lat) * 11130000 * abs(lon1 - lon2)
+    dy = 1.0      * 11130000 * abs(lat1 - lat2)
 
     return sqrt(dx * dx + dy * dy)
 
@@ -5,22 +5,38 @@ import xml.etree.ElementTree as ET
 from const import *
 import string
 
+# altitude reference -> is AGL
+ALT_REFERENCE = {
+    "GND":  True,
+    "MSL":  False,
+    "STD":  False,
+}
+
+# altitude unit -> multiplier to ft
+ALT_UNIT = {
+    "F":    1,
+    "FL":   100,
+}
+
+# unescaped '&' in the source files
+AMP_REGEX = re.compile(r"&(?!amp;|lt;|gt;)")
+
 class AipAltitude:
     def __init__(self, raw):
         reference = raw.get('REFERENCE')
         
-        if reference == "GND":
-            self.agl = True
-        elif reference in ["MSL", "STD"]:
-            self.agl = False
-        else:
+        if reference not in ALT_REFERENCE:
             raise Exception("No altitude reference!")
+        self.agl = ALT_REFERENCE[reference]
             
-        unit = raw.find('ALT').get('UNIT')
-        self.value = int(float(raw.find('ALT').text))
+        alt = raw.find('ALT')
+        text = alt.text
+        if text.isdigit():
+            value = int(text)
+        else:
+            value = int(float(text))
         
-        if unit == "FL":
-            self.value *= 100
+        self.value = value * ALT_UNIT.get(alt.get('UNIT'), 1)
 
     def __repr__(self):
         return '{}ft {}'.format(self.value, "AGL" if self.agl else "MSL")
@@ -82,8 +98,7 @@ def load_file(filepath):
 
     f = open(filepath, "r")
 
-    regex = re.compile(r"&(?!amp;|lt;|gt;)")
-    data = regex.sub("&amp;", f.read())
+    data = AMP_REGEX.sub("&amp;", f.read())
     
     f.close()
 